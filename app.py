@@ -2,13 +2,18 @@
 import gevent.monkey
 gevent.monkey.patch_all()
 
-from flask import Flask, jsonify, request
+from logging_config import setup_logging
+setup_logging()
+
+from flask import Flask, Response, request
+import orjson
 import uuid
+import time
 import atexit
 import signal
 import sys
 from async_task_manager_factory import AsyncTaskManagerFactory, TaskManagerType
-from datetime import datetime
+from base_async_task_manager import TaskManagerBusyError
 import os
 
 app = Flask(__name__)
@@ -21,19 +26,12 @@ def cleanup():
     print(f"Shutting down async task manager for PID {os.getpid()}...")
     factory.shutdown()
 
-# Register cleanup function
-atexit.register(cleanup)
-
 def signal_handler(signum, frame):
     """Handle shutdown signals."""
     print(f"Received signal {signum}, shutting down PID {os.getpid()}...")
     cleanup()
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
 def detect_worker_class():
     if 'gevent' in sys.modules:
         return 'gevent'
@@ -46,105 +44,145 @@ def detect_worker_class():
     else:
         return 'unknown'
 
-def get_task_manager():
-    """Get the task manager for the current worker process."""
-    return factory.get_task_manager()
+_iso_cached_sec = None
+_iso_cached_str = ''
 
-@app.route('/hello', methods=['GET'])
-def hello():
-    # Generate a unique UUID for this request
-    request_uuid = str(uuid.uuid4())
-    
-    # Collect some user data (headers, query params, etc.)
-    user_data = {
-        'user_agent': request.headers.get('User-Agent', 'Unknown'),
-        'ip_address': request.remote_addr,
-        'query_params': dict(request.args),
-        'timestamp': str(uuid.uuid4().time)
+def _iso_now():
+    """Equivalent of datetime.now().isoformat() that only runs strftime once per second."""
+    global _iso_cached_sec, _iso_cached_str
+    now = time.time()
+    sec = int(now)
+    if sec != _iso_cached_sec:
+        _iso_cached_sec = sec
+        _iso_cached_str = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec))
+    return f"{_iso_cached_str}.{int((now - sec) * 1_000_000):06d}"
+
+def _json_template(static_fields):
+    """Serialize the static fields of a response once, leaving the object open for dynamic fields."""
+    return orjson.dumps(static_fields)[:-1] + b','
+
+def _json_response(template, dynamic_fields):
+    """Complete a pre-serialized template with the per-request fields."""
+    return Response(template + orjson.dumps(dynamic_fields)[1:], mimetype='application/json')
+
+def _build_response_templates():
+    """Pre-serialize the parts of each response that only change per worker process."""
+    global _HELLO_TEMPLATE, _INDEX_TEMPLATE, _STATUS_TEMPLATE, _HEALTH_TEMPLATE
+    worker_info = {
+        'pid': _PID,
+        'worker_class': _WORKER_CLASS
     }
-    
-    # Trigger the async task (non-blocking)
-    task_manager = get_task_manager()
-    task_manager.trigger_async_task(request_uuid, user_data)
-    
-    # Return immediate response (not blocked by async task)
-    return jsonify({
+    _HELLO_TEMPLATE = _json_template({
         'message': 'Hello, World!',
         'status': 'success',
-        'request_uuid': request_uuid,
         'note': 'Async task triggered in background',
-        'worker_info': {
-            'pid': os.getpid(),
-            'worker_class': detect_worker_class()
-        }
+        'worker_info': worker_info
     })
-
-@app.route('/')
-def index():
-    # Generate a unique UUID for this request
-    request_uuid = str(uuid.uuid4())
-    
-    # Collect some user data
-    user_data = {
-        'user_agent': request.headers.get('User-Agent', 'Unknown'),
-        'ip_address': request.remote_addr,
-        'endpoint': '/'
-    }
-    
-    # Trigger the async task (non-blocking)
-    task_manager = get_task_manager()
-    task_manager.trigger_async_task(request_uuid, user_data)
-    
-    return jsonify({
+    _INDEX_TEMPLATE = _json_template({
         'message': 'Welcome to Flask Async Exploration',
         'endpoints': {
             'hello': '/hello',
             'status': '/status',
             'health': '/health'
         },
-        'request_uuid': request_uuid,
         'note': 'Async task triggered in background',
-        'worker_info': {
-            'pid': os.getpid(),
-            'worker_class': detect_worker_class()
-        }
+        'worker_info': worker_info
+    })
+    _STATUS_TEMPLATE = _json_template({
+        'status': 'running',
+        'message': 'Application is running with async task manager',
+        'worker_info': worker_info
     })
+    _HEALTH_TEMPLATE = _json_template({
+        'status': 'healthy',
+        'pid': _PID,
+        'worker_info': worker_info
+    })
+
+# Neither value changes within a worker process, so compute them once.
+# Only the PID (and the templates embedding it) needs refreshing when
+# gunicorn forks workers from a preloaded master.
+_WORKER_CLASS = detect_worker_class()
+_PID = os.getpid()
+_build_response_templates()
+
+def _refresh_pid():
+    global _PID
+    _PID = os.getpid()
+    _build_response_templates()
+
+os.register_at_fork(after_in_child=_refresh_pid)
+
+_BUSY_BODY = orjson.dumps({
+    'status': 'busy',
+    'message': 'Async task backlog is full, retry later'
+})
+
+@app.errorhandler(TaskManagerBusyError)
+def task_manager_busy(e):
+    """Reject the request with a 503 instead of queueing work without bound."""
+    return Response(_BUSY_BODY, status=503, mimetype='application/json', headers={'Retry-After': '1'})
+
+@app.route('/hello', methods=['GET'])
+def hello():
+    # Generate a unique UUID for this request
+    request_uuid = uuid.uuid4().hex
+    
+    # Trigger the async task (non-blocking) with some user data (headers, query string, etc.)
+    factory.get_task_manager().trigger_async_task(
+        request_uuid,
+        request.headers.get('User-Agent', 'Unknown'),
+        request.remote_addr,
+        '/hello',
+        # Raw query string: skips building a MultiDict nobody reads
+        request.query_string.decode('latin-1') if request.query_string else ''
+    )
+    
+    # Return immediate response (not blocked by async task)
+    return _json_response(_HELLO_TEMPLATE, {'request_uuid': request_uuid})
+
+@app.route('/')
+def index():
+    # Generate a unique UUID for this request
+    request_uuid = uuid.uuid4().hex
+    
+    # Trigger the async task (non-blocking) with some user data
+    factory.get_task_manager().trigger_async_task(
+        request_uuid,
+        request.headers.get('User-Agent', 'Unknown'),
+        request.remote_addr,
+        '/'
+    )
+    
+    return _json_response(_INDEX_TEMPLATE, {'request_uuid': request_uuid})
 
 @app.route('/status', methods=['GET'])
 def status():
     """Endpoint to check application status without triggering async task."""
-    task_manager = get_task_manager()
-    async_status = task_manager.get_status()
-    return jsonify({
-        'status': 'running',
-        'message': 'Application is running with async task manager',
+    async_status = factory.get_task_manager().get_status()
+    return _json_response(_STATUS_TEMPLATE, {
         'async_task_manager': async_status,
         'async_task_manager_type': async_status.get('type', 'unknown'),
-        'timestamp': datetime.now().isoformat(),
-        'worker_info': {
-            'pid': os.getpid(),
-            'worker_class': detect_worker_class()
-        }
+        'timestamp': _iso_now()
     })
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint that doesn't trigger async tasks."""
-    task_manager = get_task_manager()
-    async_status = task_manager.get_status()
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'pid': os.getpid(),
+    async_status = factory.get_task_manager().get_status()
+    return _json_response(_HEALTH_TEMPLATE, {
+        'timestamp': _iso_now(),
         'async_task_manager': async_status,
-        'async_task_manager_type': async_status.get('type', 'unknown'),
-        'worker_info': {
-            'pid': os.getpid(),
-            'worker_class': detect_worker_class()
-        }
+        'async_task_manager_type': async_status.get('type', 'unknown')
     })
 
 if __name__ == '__main__':
+    # Under gunicorn the worker_exit hook in gunicorn.conf.py calls cleanup();
+    # installing these at import would also put them in the preloaded master.
+    atexit.register(cleanup)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
     try:
         app.run(debug=True, host='0.0.0.0', port=5000)
     finally:
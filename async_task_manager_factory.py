@@ -1,9 +1,13 @@
 from enum import Enum
+import logging
 import os
+import gevent
 from gevent_async_task_manager import GeventBasedAsyncTaskManager
 from thread_pool_async_task_manager import ThreadPoolBasedAsyncTaskManager
 from async_task_manager import AsyncTaskManager
 
+logger = logging.getLogger(__name__)
+
 class TaskManagerType(Enum):
     GEVENT = "gevent"
     THREAD_POOL = "thread_pool"
@@ -12,18 +16,14 @@ class TaskManagerType(Enum):
 class AsyncTaskManagerFactory:
     """Factory for creating different types of async task managers."""
     
-    _instances = {}  # Process-specific instances
-    _task_managers = {}  # Process-specific task managers
+    _instance = None  # Process-wide singleton; its task manager is reset after fork
     
     @classmethod
     def get_instance(cls):
         """Get the singleton instance of the factory for the current process."""
-        pid = os.getpid()
-        print(f"DEBUG: get_instance called, pid={pid}")
-        print(f"DEBUG: _instances={cls._instances}")
-        if pid not in cls._instances:
-            cls._instances[pid] = cls()
-        return cls._instances[pid]
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
     
     def __init__(self):
         # Don't create task manager in __init__ - create it lazily
@@ -32,27 +32,31 @@ class AsyncTaskManagerFactory:
     
     def get_task_manager(self):
         """Get the current task manager instance, creating it if necessary."""
-        pid = os.getpid()
-        print(f"DEBUG: get_task_manager called, pid={pid}")
-        print(f"DEBUG: _task_managers={self._task_managers}")
-        if pid not in self._task_managers:
-            print(f"DEBUG: Creating new task manager for PID {pid}")
-            self._task_managers[pid] = self.create_task_manager(self._manager_type)
-        return self._task_managers[pid]
+        return self._task_manager or self._create_default_task_manager()
+    
+    def _create_default_task_manager(self):
+        """Create the task manager for this process using the configured type."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Creating new task manager for PID %s", os.getpid())
+        self._task_manager = self.create_task_manager(self._manager_type)
+        return self._task_manager
+    
+    def _reset_after_fork(self):
+        """Forget the task manager inherited from the parent process; its pool belongs to the parent."""
+        self._task_manager = None
     
     def set_task_manager(self, manager_type: TaskManagerType = TaskManagerType.GEVENT, **kwargs):
         """Set a new task manager instance."""
-        pid = os.getpid()
-        
         # Shutdown existing task manager if it exists
-        if pid in self._task_managers and self._task_managers[pid]:
-            self._task_managers[pid].shutdown()
+        if self._task_manager:
+            self._task_manager.shutdown()
         
         # Create new task manager
         self._manager_type = manager_type
-        self._task_managers[pid] = self.create_task_manager(manager_type, **kwargs)
-        print(f"DEBUG: Set new task manager for PID {pid}: {manager_type.value}")
-        return self._task_managers[pid]
+        self._task_manager = self.create_task_manager(manager_type, **kwargs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Set new task manager for PID %s: %s", os.getpid(), manager_type.value)
+        return self._task_manager
     
     @staticmethod
     def create_task_manager(manager_type: TaskManagerType = TaskManagerType.GEVENT, **kwargs):
@@ -66,7 +70,8 @@ class AsyncTaskManagerFactory:
         Returns:
             An instance of the specified async task manager
         """
-        print(f"DEBUG: Creating task manager of type: {manager_type.value}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Creating task manager of type: %s", manager_type.value)
         if manager_type == TaskManagerType.GEVENT:
             return GeventBasedAsyncTaskManager(**kwargs)
         elif manager_type == TaskManagerType.THREAD_POOL:
@@ -94,18 +99,19 @@ class AsyncTaskManagerFactory:
         except ValueError:
             raise ValueError(f"Unknown task manager name: {manager_name}. Available types: {[t.value for t in TaskManagerType]}")
     
-    def __getattr__(self, name):
-        """Delegate attribute access to the task manager instance."""
-        task_manager = self.get_task_manager()
-        return getattr(task_manager, name)
-    
     def shutdown(self):
-        """Shutdown all task managers for the current process."""
-        pid = os.getpid()
-        if pid in self._task_managers and self._task_managers[pid]:
-            print(f"DEBUG: Shutting down task manager for PID {pid}")
-            self._task_managers[pid].shutdown()
-            del self._task_managers[pid]
+        """Shutdown the task manager for the current process."""
+        if self._task_manager:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Shutting down task manager for PID %s", os.getpid())
+            self._task_manager.shutdown()
+            self._task_manager = None
+
+def _reinit_after_fork():
+    """Give a forked child (e.g. a gunicorn worker) a fresh hub and its own task manager."""
+    gevent.reinit()
+    if AsyncTaskManagerFactory._instance is not None:
+        AsyncTaskManagerFactory._instance._reset_after_fork()
 
-# Don't create a global instance - let each worker create its own
-# The factory will be accessed through get_instance() when needed 
\ No newline at end of file
+os.register_at_fork(after_in_child=_reinit_after_fork)
+ 
\ No newline at end of file
@@ -1,109 +1,169 @@
 import uuid
+from typing import Union
 import time
-from datetime import datetime
+import logging
 import os
-import sys
+from random import random as _rand
 import threading
-from abc import ABC, abstractmethod
+from collections import deque
 
-class BaseAsyncTaskManager(ABC):
+logger = logging.getLogger(__name__)
+
+# Probability that a task raises a simulated error; off unless SIM_FAIL_RATE is set
+_SIM_FAIL_RATE = float(os.environ.get('SIM_FAIL_RATE', '0'))
+
+_LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+def _uuid_str(request_uuid: Union[uuid.UUID, str]) -> str:
+    """Return request_uuid as the hex string used in logs; strings pass through unchanged."""
+    return request_uuid if isinstance(request_uuid, str) else request_uuid.hex
+
+class TaskManagerBusyError(RuntimeError):
+    """Raised by trigger_async_task when the manager's task backlog is full."""
+
+class BaseAsyncTaskManager:
     """Base class for async task managers with common functionality."""
     
     def __init__(self):
         self._running = False
-        self._active_tasks = 0
+        # One entry per in-flight task. deque append/pop are atomic under the GIL,
+        # so executor threads can update the count without a lock.
+        self._inflight = deque()
+        self._pid = os.getpid()
     
-    def _print_async(self, level: str, message: str):
-        """Print method that doesn't interfere with the task execution."""
-        try:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print(f"[{timestamp}] [{level.upper()}] {message}")
-        except Exception as e:
-            # If printing fails, write to stderr as fallback
-            print(f"Print error: {e} - Original message: {message}", file=sys.stderr)
+    @property
+    def _active_tasks(self) -> int:
+        return len(self._inflight)
+    
+    def _task_started(self):
+        self._inflight.append(None)
+    
+    def _task_finished(self, count: int = 1):
+        for _ in range(count):
+            try:
+                self._inflight.pop()
+            except IndexError:
+                break
+    
+    def _print_async(self, level: str, message: str, *args):
+        """
+        Hand the message to the logging queue; the write happens on the listener thread.
+        Pass values as %-style args so nothing is formatted when the level is disabled.
+        """
+        logger.log(_LOG_LEVELS[level], message, *args)
     
-    def _execute_long_running_task(self, request_uuid: str, user_data: dict = None):
+    def _execute_long_running_task(self, request_uuid: str, user_agent: str = None, ip_address: str = None,
+                                   endpoint: str = None, query_string: str = None):
         """
         Execute the actual long-running task.
         This is the common task execution logic.
         """
-        start_time = time.time()
-        thread_id = getattr(threading.current_thread(), 'ident', 'unknown') if 'threading' in globals() else 'unknown'
-        self._print_async('info', f"Starting async task for request UUID: {request_uuid} (PID: {os.getpid()}, Thread: {thread_id})")
+        start_time = time.monotonic()
+        thread_id = threading.get_ident()
+        self._print_async('info', "Starting async task for request UUID: %s (PID: %s, Thread: %s)", request_uuid, self._pid, thread_id)
         
         try:
-            print(f"Starting async task for request UUID: {request_uuid} (PID: {os.getpid()})")
-            # Simulate some work
-            time.sleep(5)  # Simulate 5 seconds of work
-            
-            # Simulate some potential errors (10% chance)
-            import random
-            if random.random() < 0.1:
+            # Simulate 8 seconds of work in one sleep; a simulated error
+            # (SIM_FAIL_RATE chance) surfaces 5 seconds in
+            fail = _SIM_FAIL_RATE and _rand() < _SIM_FAIL_RATE
+            time.sleep(5 if fail else 8)
+            if fail:
                 raise Exception(f"Simulated error in async task for UUID: {request_uuid}")
             
-            # Simulate more work
-            time.sleep(3)
-            
             # Log success
-            end_time = time.time()
+            end_time = time.monotonic()
             duration = end_time - start_time
             self._print_async('info',
-                f"Async task completed successfully for request UUID: {request_uuid} "
-                f"(duration: {duration:.2f}s, PID: {os.getpid()}, Thread: {thread_id}, user_data: {user_data})"
+                "Async task completed successfully for request UUID: %s "
+                "(duration: %.2fs, PID: %s, Thread: %s, user_agent: %s, ip_address: %s, endpoint: %s, query_string: %s)",
+                request_uuid, duration, self._pid, thread_id, user_agent, ip_address, endpoint, query_string
             )
             
-            return {"status": "success", "duration": duration, "uuid": request_uuid}
+            return duration
             
         except Exception as e:
             # Log error
-            end_time = time.time()
+            end_time = time.monotonic()
             duration = end_time - start_time
             self._print_async('error',
-                f"Async task failed for request UUID: {request_uuid} "
-                f"(duration: {duration:.2f}s, PID: {os.getpid()}, Thread: {thread_id}, error: {str(e)})"
+                "Async task failed for request UUID: %s "
+                "(duration: %.2fs, PID: %s, Thread: %s, error: %s)",
+                request_uuid, duration, self._pid, thread_id, e
             )
             raise
     
     def _handle_task_completion(self, request_uuid: str, future_or_result):
         """Handle the completion of an async task."""
+        if getattr(future_or_result, 'cancelled', None) and future_or_result.cancelled():
+            # Still queued when the executor shut down
+            self._task_finished()
+            self._print_async('warning', "Task cancelled for request UUID: %s (PID: %s, Active: %s)", request_uuid, self._pid, self._active_tasks)
+            return
         try:
-            # Handle both Future objects and direct results
+            # Only called for its side effect: re-raises the task's exception
             if hasattr(future_or_result, 'result'):
-                result = future_or_result.result()
-            else:
-                result = future_or_result
+                future_or_result.result()
             
-            # Simple decrement without lock (gevent-friendly)
-            self._active_tasks = max(0, self._active_tasks - 1)
-            self._print_async('info', f"Task completion handled for request UUID: {request_uuid} (PID: {os.getpid()}, Active: {self._active_tasks})")
+            self._task_finished()
+            self._print_async('info', "Task completion handled for request UUID: %s (PID: %s, Active: %s)", request_uuid, self._pid, self._active_tasks)
         except Exception as e:
-            # Simple decrement without lock (gevent-friendly)
-            self._active_tasks = max(0, self._active_tasks - 1)
-            self._print_async('error', f"Task completion error for request UUID: {request_uuid} (PID: {os.getpid()}): {str(e)}")
+            self._task_finished()
+            self._print_async('error', "Task completion error for request UUID: %s (PID: %s): %s", request_uuid, self._pid, e)
+    
+    def _on_task_success(self, request_uuid: str, greenlet):
+        """Handle the completion of an async task that finished without raising."""
+        self._task_finished()
+        self._print_async('info', "Task completion handled for request UUID: %s (PID: %s, Active: %s)", request_uuid, self._pid, self._active_tasks)
+    
+    def _on_task_error(self, request_uuid: str, greenlet):
+        """Handle the completion of an async task that raised."""
+        self._task_finished()
+        self._print_async('error', "Task completion error for request UUID: %s (PID: %s): %s", request_uuid, self._pid, greenlet.exception)
     
     def get_status(self):
         """Get the current status of the async task manager."""
         return {
             "running": self._running,
             "active_tasks": self._active_tasks,
-            "pid": os.getpid(),
+            "pid": self._pid,
             "type": self.get_manager_type()
         }
     
-    @abstractmethod
     def get_manager_type(self) -> str:
         """Return the type of this async task manager."""
-        pass
+        raise NotImplementedError
     
-    @abstractmethod
-    def trigger_async_task(self, request_uuid: str, user_data: dict = None):
+    def trigger_async_task(self, request_uuid: Union[uuid.UUID, str], user_agent: str = None, ip_address: str = None,
+                           endpoint: str = None, query_string: str = None):
         """
         Trigger an async task for the given request UUID.
         This method is non-blocking and returns immediately.
         """
-        pass
+        raise NotImplementedError
+    
+    def trigger_async_tasks(self, request_uuids, user_agent: str = None, ip_address: str = None,
+                            endpoint: str = None, query_string: str = None):
+        """
+        Trigger one async task per request UUID, all sharing the same request data.
+        Returns the list of UUIDs that were triggered. If one fails (e.g. with
+        TaskManagerBusyError), the exception is re-raised with an `accepted`
+        attribute listing the UUIDs already queued, so a retry can skip them.
+        """
+        trigger = self.trigger_async_task
+        accepted = []
+        try:
+            for request_uuid in request_uuids:
+                accepted.append(trigger(request_uuid, user_agent, ip_address, endpoint, query_string))
+        except Exception as e:
+            e.accepted = accepted
+            raise
+        return accepted
     
-    @abstractmethod
     def shutdown(self):
         """Shutdown the async task manager."""
-        pass 
\ No newline at end of file
+        raise NotImplementedError 
\ No newline at end of file
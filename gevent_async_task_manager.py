@@ -1,12 +1,24 @@
-# Monkey patch for gevent compatibility - MUST be at the very top
-import gevent.monkey
-gevent.monkey.patch_all()
-
 import gevent
+import gevent.monkey
 from gevent.pool import Pool
+from gevent.queue import Queue
+from collections import deque
+from functools import partial
+import logging
 import os
-import sys
-from base_async_task_manager import BaseAsyncTaskManager
+import uuid
+from typing import Union
+from base_async_task_manager import BaseAsyncTaskManager, _uuid_str
+
+# Patching is the entry point's job (app.py, or gunicorn's gevent worker);
+# a late patch here would miss threads and locks created before this import.
+if not gevent.monkey.is_module_patched('socket'):
+    raise RuntimeError("gevent.monkey.patch_all() must be called before importing gevent_async_task_manager")
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of queued submissions the dispatcher moves into the pool per wakeup
+_DISPATCH_BATCH_SIZE = 64
 
 class GeventBasedAsyncTaskManager(BaseAsyncTaskManager):
     """Async task manager using gevent greenlets for background task execution."""
@@ -15,7 +27,12 @@ class GeventBasedAsyncTaskManager(BaseAsyncTaskManager):
         super().__init__()
         self._max_workers = max_workers
         self._pool = None
-        self._pid = None
+        # Submitted tasks, drained into the pool by a single dispatcher greenlet
+        self._submit_q = Queue()
+        # Tasks the dispatcher has taken off the queue but not yet spawned; kept on
+        # the manager so shutdown can account for them
+        self._dispatch_batch = deque()
+        self._dispatcher = None
         self._start_gevent_pool()
     
     def get_manager_type(self) -> str:
@@ -24,113 +41,117 @@ class GeventBasedAsyncTaskManager(BaseAsyncTaskManager):
     def _start_gevent_pool(self):
         """Start a gevent pool for handling async tasks."""
         current_pid = os.getpid()
-        print(f"DEBUG: _start_gevent_pool called, _running={self._running}, current_pid={current_pid}, _pid={self._pid}")
         
         # Check if we're in a new process (forked from master)
-        if self._pid is not None and self._pid != current_pid:
-            print(f"DEBUG: Process changed from {self._pid} to {current_pid}, reinitializing pool")
+        if self._pid != current_pid:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Process changed from %s to %s, reinitializing pool", self._pid, current_pid)
+            self._pid = current_pid
             self._running = False
             self._pool = None
+            self._submit_q = Queue()
+            self._dispatch_batch = deque()
+            self._dispatcher = None
         
-        print(f"DEBUG: _running={self._running}, _pool={self._pool}")
         if self._running:
-            self._print_async('info', f"Gevent pool already running (PID: {current_pid})")
+            self._print_async('info', "Gevent pool already running (PID: %s)", current_pid)
         else:
             try:
-                print(f"DEBUG: Creating gevent pool with {self._max_workers} workers (PID: {current_pid})")
                 self._pool = Pool(self._max_workers)
+                self._dispatcher = gevent.spawn(self._dispatch_tasks)
                 self._running = True
-                self._pid = current_pid
-                self._print_async('info', f"Gevent pool started with {self._max_workers} workers (PID: {current_pid})")
-                print(f"DEBUG: Gevent pool created: {self._pool}")
+                self._print_async('info', "Gevent pool started with %s workers (PID: %s)", self._max_workers, current_pid)
             except Exception as e:
-                self._print_async('error', f"Failed to start gevent pool: {e}")
-                print(f"DEBUG: Gevent pool error: {type(e).__name__}: {e}")
-                import traceback
-                traceback.print_exc()
+                self._print_async('error', "Failed to start gevent pool: %s", e)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Gevent pool error details", exc_info=True)
                 raise
     
-    def trigger_async_task(self, request_uuid: str, user_data: dict = None):
+    def trigger_async_task(self, request_uuid: Union[uuid.UUID, str], user_agent: str = None, ip_address: str = None,
+                           endpoint: str = None, query_string: str = None):
         """
         Trigger an async task for the given request UUID.
         This method is non-blocking and returns immediately.
         """
-        current_pid = os.getpid()
-        print(f"DEBUG: trigger_async_task called for UUID: {request_uuid} (PID: {current_pid})")
-        print(f"DEBUG: _running={self._running}, _pool={self._pool}, _pid={self._pid}, current_pid={current_pid}")
-        
+        request_uuid = _uuid_str(request_uuid)
+        if not self._running:
+            self._print_async('error', "Gevent pool is shut down")
+            raise RuntimeError("Gevent pool is shut down")
         
         try:
-            print(f"DEBUG: About to submit task to gevent pool (PID: {current_pid})")
-            # Submit the task to the gevent pool
-            greenlet = self._pool.spawn(
-                self._execute_long_running_task,
-                request_uuid,
-                user_data
-            )
-            print(f"DEBUG: Task submitted successfully, greenlet: {greenlet} (PID: {current_pid})")
-            
-            # Add a callback to handle task completion
-            greenlet.link(lambda g: self._handle_task_completion(request_uuid, g))
-            print(f"DEBUG: Callback added successfully (PID: {current_pid})")
+            # Hand the task to the dispatcher; it spawns it once a pool slot is free
+            self._submit_q.put_nowait((request_uuid, user_agent, ip_address, endpoint, query_string))
             
-            # Simple increment without lock (gevent-friendly)
-            self._active_tasks += 1
+            self._task_started()
             
-            self._print_async('info', f"Async task triggered for request UUID: {request_uuid} (PID: {current_pid}, Active: {self._active_tasks})")
+            self._print_async('info', "Async task triggered for request UUID: %s (PID: %s, Active: %s)", request_uuid, self._pid, self._active_tasks)
             return request_uuid
         except Exception as e:
-            self._print_async('error', f"Failed to trigger async task for UUID {request_uuid}: {e}")
-            print(f"DEBUG: Exception details: {type(e).__name__}: {e} (PID: {current_pid})")
-            import traceback
-            traceback.print_exc()
+            self._print_async('error', "Failed to trigger async task for UUID %s: %s", request_uuid, e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Exception details (PID: %s)", self._pid, exc_info=True)
             raise
     
+    def _spawn_task(self, task_args: tuple):
+        """Submit the task to the gevent pool and link its completion callback."""
+        request_uuid = task_args[0]
+        greenlet = self._pool.spawn(self._execute_long_running_task, *task_args)
+        
+        # Separate success/failure callbacks so neither has to inspect the greenlet state
+        greenlet.link_value(partial(self._on_task_success, request_uuid))
+        greenlet.link_exception(partial(self._on_task_error, request_uuid))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Task submitted to gevent pool for UUID: %s (PID: %s)", request_uuid, self._pid)
+    
+    def _dispatch_tasks(self):
+        """
+        Move submitted tasks into the pool in batches.
+        Pool.spawn() blocks while all max_workers slots are busy, which gives
+        back-pressure here instead of on the request greenlets.
+        """
+        submit_q = self._submit_q
+        batch = self._dispatch_batch
+        while True:
+            batch.append(submit_q.get())
+            for _ in range(min(submit_q.qsize(), _DISPATCH_BATCH_SIZE - 1)):
+                batch.append(submit_q.get_nowait())
+            while batch:
+                # Leave the task in the batch until it is spawned; spawn() is
+                # where this greenlet blocks, and may be killed, while the pool is full
+                self._spawn_task(batch[0])
+                batch.popleft()
+    
     def _restart_gevent_pool(self):
         """Restart the gevent pool if it's not working properly."""
-        current_pid = os.getpid()
         self._print_async('info', "Restarting gevent pool...")
+        # shutdown() kills the dispatcher and pool with block=True, so there
+        # is nothing left to wait for before starting a new pool
         self.shutdown()
-        gevent.sleep(0.1)  # Non-blocking sleep
-        print(f"DEBUG: Restarting gevent pool (PID: {current_pid})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Restarting gevent pool (PID: %s)", self._pid)
         self._start_gevent_pool()
     
-    def _handle_task_completion(self, request_uuid: str, greenlet):
-        """Handle the completion of an async task."""
-        current_pid = os.getpid()
-        try:
-            # For gevent greenlets, we need to handle the result differently
-            if greenlet.successful():
-                result = greenlet.value
-            else:
-                # If the greenlet failed, get the exception
-                result = greenlet.exception
-            
-            # Simple decrement without lock (gevent-friendly)
-            self._active_tasks = max(0, self._active_tasks - 1)
-            self._print_async('info', f"Task completion handled for request UUID: {request_uuid} (PID: {current_pid}, Active: {self._active_tasks})")
-        except Exception as e:
-            # Simple decrement without lock (gevent-friendly)
-            self._active_tasks = max(0, self._active_tasks - 1)
-            self._print_async('error', f"Task completion error for request UUID: {request_uuid} (PID: {current_pid}): {str(e)}")
-    
     def get_status(self):
         """Get the current status of the async task manager."""
         status = super().get_status()
         status["max_workers"] = self._max_workers
+        status["pending_tasks"] = self._submit_q.qsize() + len(self._dispatch_batch)
         return status
     
     def shutdown(self):
         """Shutdown the async task manager."""
-        current_pid = os.getpid()
-        if self._running and self._pool:
+        if self._running and self._pool is not None:
             try:
-                self._print_async('info', f"Shutting down gevent pool (PID: {current_pid}, Active tasks: {self._active_tasks})")
+                self._print_async('info', "Shutting down gevent pool (PID: %s, Active tasks: %s)", self._pid, self._active_tasks)
                 self._running = False
                 
-                # Kill all greenlets in the pool
+                # Stop the dispatcher, drop queued tasks and kill all greenlets in the pool
+                self._dispatcher.kill()
+                self._task_finished(self._submit_q.qsize() + len(self._dispatch_batch))
+                self._submit_q = Queue()
+                self._dispatch_batch = deque()
                 self._pool.kill()
                 
-                self._print_async('info', f"GeventBasedAsyncTaskManager shutdown complete (PID: {current_pid})")
+                self._print_async('info', "GeventBasedAsyncTaskManager shutdown complete (PID: %s)", self._pid)
             except Exception as e:
-                self._print_async('error', f"Error during shutdown: {e}") 
\ No newline at end of file
+                self._print_async('error', "Error during shutdown: %s", e)
\ No newline at end of file
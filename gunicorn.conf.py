@@ -1,11 +1,22 @@
 # Gunicorn configuration file for async performance
+import multiprocessing
+import os
+
 bind = "0.0.0.0:8000"
-workers = 4
-worker_class = "gevent"  # Use gevent workers for async performance (more widely supported)
-worker_connections = 1000
+# (2 * CPU) + 1 workers by default; override with GUNICORN_WORKERS
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Use gevent workers for async performance (more widely supported). app.py
+# monkey patches with gevent and the task managers run on its hub, so an
+# override via GUNICORN_WORKER_CLASS should stay gevent-compatible.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+# Concurrent greenlets per gevent worker; override with GUNICORN_WORKER_CONNECTIONS
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
 timeout = 30
 keepalive = 2
-max_requests = 1000
+# Worker recycling is off by default: a recycle cuts off in-flight 8 second tasks
+# and pays for a fresh fork + task manager. Set GUNICORN_MAX_REQUESTS to re-enable
+# it; worker_exit shuts the task manager down before the worker goes away.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
 max_requests_jitter = 50  # Reduced jitter for more predictable behavior
 preload_app = True
 
@@ -42,4 +53,6 @@ def worker_abort(worker):
 
 def worker_exit(server, worker):
     """Called when a worker exits."""
-    print(f"Worker {worker.pid} exited") 
\ No newline at end of file
+    print(f"Worker {worker.pid} exited")
+    import app
+    app.cleanup() 
\ No newline at end of file
@@ -0,0 +1,72 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_FORMAT = '[%(asctime)s] [%(levelname)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_queue_handler = None
+_listener = None
+
+
+class _CachedSecondFormatter(logging.Formatter):
+    """Formatter that runs strftime at most once per wall-clock second."""
+
+    _cached_sec = None
+    _cached_str = ''
+
+    def formatTime(self, record, datefmt=None):
+        sec = int(record.created)
+        if sec != self._cached_sec:
+            self._cached_sec = sec
+            self._cached_str = time.strftime(datefmt or DATE_FORMAT, self.converter(sec))
+        return self._cached_str
+
+
+def _start_listener():
+    """Create a fresh queue + listener and point the root queue handler at it."""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(_CachedSecondFormatter(LOG_FORMAT, DATE_FORMAT))
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_logging(level: str = None):
+    """
+    Configure the root logger to hand records to a queue drained by a background
+    listener thread (a greenlet once threading is monkey patched), so request
+    handlers never block on stdout.
+    Safe to call more than once; only the first call has any effect.
+    """
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    _queue_handler = logging.handlers.QueueHandler(None)
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+    _start_listener()
+
+    # The listener thread does not survive fork (gunicorn preload_app). Drain and
+    # stop it before forking so no child inherits undelivered records, then give
+    # the parent and every child a fresh queue and listener.
+    os.register_at_fork(before=stop_logging, after_in_parent=_start_listener,
+                        after_in_child=_start_listener)
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush any queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,116 +1,163 @@
 import uuid
+from typing import Union
 import time
-from datetime import datetime
 import threading
-import os
+import logging
 import sys
 from concurrent.futures import ThreadPoolExecutor
-from base_async_task_manager import BaseAsyncTaskManager
+from functools import partial
+from gevent import monkey
+from base_async_task_manager import BaseAsyncTaskManager, TaskManagerBusyError, _uuid_str
+
+# Under the gevent worker threading is monkey patched, so the executor's workers
+# are greenlets and time.sleep yields to the hub. The pool can then be sized like
+# the gevent manager's rather than like a native thread pool; submit() only
+# appends to the work queue, so it never blocks the request greenlet.
+_DEFAULT_MAX_WORKERS = 100 if monkey.is_module_patched('threading') else 4
+
+# In-flight tasks allowed per worker before new submissions are rejected; the
+# executor's work queue is unbounded, so cap what is allowed to pile up in it
+_BACKLOG_PER_WORKER = 4
+
+logger = logging.getLogger(__name__)
 
 class ThreadPoolBasedAsyncTaskManager(BaseAsyncTaskManager):
-    def __init__(self, max_workers=4):
+    def __init__(self, max_workers=None):
         super().__init__()
+        # The executor is created on first use, so no threads exist in the
+        # preloaded gunicorn master; each worker starts its own after fork
         self._executor = None
-        self._max_workers = max_workers
-        self._start_thread_pool()
+        self._max_workers = max_workers or _DEFAULT_MAX_WORKERS
+        
+        # Set while a background restart is running; submissions are rejected meanwhile
+        self._restart_inflight = False
     
     def get_manager_type(self) -> str:
         return "thread_pool"
     
     def _start_thread_pool(self):
         """Start a thread pool for handling async tasks."""
-        print(f"DEBUG: _start_thread_pool called, _running={self._running}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("_start_thread_pool called, _running=%s", self._running)
         
         if self._running:
-            self._print_async('info', f"Thread pool already running (PID: {os.getpid()})")
+            self._print_async('info', "Thread pool already running (PID: %s)", self._pid)
             return
             
         try:
             self._executor = ThreadPoolExecutor(
                 max_workers=self._max_workers,
-                thread_name_prefix=f"AsyncWorker-{os.getpid()}"
+                thread_name_prefix=f"AsyncWorker-{self._pid}"
             )
             self._running = True
-            self._print_async('info', f"Thread pool started with {self._max_workers} workers (PID: {os.getpid()})")
-            print(f"DEBUG: Thread pool created: {self._executor}")
+            self._print_async('info', "Thread pool started with %s workers (PID: %s)", self._max_workers, self._pid)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Thread pool created: %s", self._executor)
         except Exception as e:
-            self._print_async('error', f"Failed to start thread pool: {e}")
-            print(f"DEBUG: Thread pool error: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
+            self._print_async('error', "Failed to start thread pool: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Thread pool error details", exc_info=True)
             raise
     
-    def trigger_async_task(self, request_uuid: str, user_data: dict = None):
+    def trigger_async_task(self, request_uuid: Union[uuid.UUID, str], user_agent: str = None, ip_address: str = None,
+                           endpoint: str = None, query_string: str = None):
         """
         Trigger an async task for the given request UUID.
         This method is non-blocking and returns immediately.
         """
-        print(f"DEBUG: trigger_async_task called for UUID: {request_uuid}")
-        print(f"DEBUG: _running={self._running}, _executor={self._executor}")
+        request_uuid = _uuid_str(request_uuid)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("trigger_async_task called for UUID: %s (_running=%s, _executor=%s)",
+                         request_uuid, self._running, self._executor)
+        
+        if self._restart_inflight:
+            raise TaskManagerBusyError("Thread pool is restarting")
         
         if not self._running or not self._executor:
-            self._print_async('warning', "Thread pool not ready, restarting...")
             self._start_thread_pool()
             
-            # Check again after restart
-            print(f"DEBUG: After restart - _running={self._running}, _executor={self._executor}")
+            # Check again after starting
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("After start - _running=%s, _executor=%s", self._running, self._executor)
             if not self._running or not self._executor:
-                self._print_async('error', "Thread pool still not ready after restart")
+                self._print_async('error', "Thread pool still not ready after start")
                 raise RuntimeError("Thread pool failed to start")
         
+        if self._active_tasks >= self._max_workers * _BACKLOG_PER_WORKER:
+            self._print_async('warning', "Thread pool saturated, rejecting request UUID: %s (PID: %s, Active: %s)",
+                              request_uuid, self._pid, self._active_tasks)
+            raise TaskManagerBusyError("Thread pool backlog is full")
+        
+        # Count the task before submitting so a fast completion callback can't run first
+        self._task_started()
         try:
-            print(f"DEBUG: About to submit task to thread pool")
             # Submit the task to the thread pool
             future = self._executor.submit(
                 self._execute_long_running_task,
                 request_uuid,
-                user_data
+                user_agent,
+                ip_address,
+                endpoint,
+                query_string
             )
-            print(f"DEBUG: Task submitted successfully, future: {future}")
             
             # Add a callback to handle task completion
-            future.add_done_callback(
-                lambda f: self._handle_task_completion(request_uuid, f)
-            )
-            print(f"DEBUG: Callback added successfully")
-            
-            # Simple increment without lock (gevent-friendly)
-            self._active_tasks += 1
+            future.add_done_callback(partial(self._handle_task_completion, request_uuid))
             
-            self._print_async('info', f"Async task triggered for request UUID: {request_uuid} (PID: {os.getpid()}, Active: {self._active_tasks})")
+            self._print_async('info', "Async task triggered for request UUID: %s (PID: %s, Active: %s)", request_uuid, self._pid, self._active_tasks)
             return request_uuid
         except Exception as e:
-            self._print_async('error', f"Failed to trigger async task for UUID {request_uuid}: {e}")
-            print(f"DEBUG: Exception details: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            # Try to restart the thread pool
-            self._restart_thread_pool()
+            self._task_finished()
+            self._print_async('error', "Failed to trigger async task for UUID %s: %s", request_uuid, e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Exception details (PID: %s)", self._pid, exc_info=True)
+            # Restart the thread pool off the request path; shutdown() waits for running tasks
+            self._schedule_restart()
             raise
     
+    def _schedule_restart(self):
+        """Restart the thread pool in the background; only one restart runs at a time."""
+        if self._restart_inflight:
+            return
+        self._restart_inflight = True
+        threading.Thread(target=self._restart_thread_pool, name=f"AsyncRestart-{self._pid}", daemon=True).start()
+    
     def _restart_thread_pool(self):
         """Restart the thread pool if it's not working properly."""
         self._print_async('info', "Restarting thread pool...")
-        self.shutdown()
-        time.sleep(0.1)  # Regular sleep since we're using thread pool
-        self._start_thread_pool()
+        try:
+            self.shutdown()
+            time.sleep(0.1)  # Regular sleep since we're using thread pool
+            self._start_thread_pool()
+        finally:
+            self._restart_inflight = False
     
     def get_status(self):
         """Get the current status of the async task manager."""
         status = super().get_status()
         status["max_workers"] = self._max_workers
+        # Before the first task the manager is ready but has no executor yet;
+        # report that as idle rather than as not running
+        status["pool_started"] = self._executor is not None
+        if self._executor is None:
+            status["running"] = True
         return status
     
     def shutdown(self):
         """Shutdown the async task manager."""
         if self._running and self._executor:
             try:
-                self._print_async('info', f"Shutting down thread pool (PID: {os.getpid()}, Active tasks: {self._active_tasks})")
+                self._print_async('info', "Shutting down thread pool (PID: %s, Active tasks: %s)", self._pid, self._active_tasks)
                 self._running = False
                 
-                # Shutdown executor gracefully
-                self._executor.shutdown(wait=True)
+                # Drop tasks still queued in the executor and wait only for the running
+                # ones; restarts already happen off the request path. cancel_futures
+                # is new in Python 3.9; older versions also wait for the queued tasks.
+                if sys.version_info >= (3, 9):
+                    self._executor.shutdown(wait=True, cancel_futures=True)
+                else:
+                    self._executor.shutdown(wait=True)
                 
-                self._print_async('info', f"ThreadPoolBasedAsyncTaskManager shutdown complete (PID: {os.getpid()})")
+                self._print_async('info', "ThreadPoolBasedAsyncTaskManager shutdown complete (PID: %s)", self._pid)
             except Exception as e:
-                self._print_async('error', f"Error during shutdown: {e}") 
\ No newline at end of file
+                self._print_async('error', "Error during shutdown: %s", e) 
\ No newline at end of file